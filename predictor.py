@@ -0,0 +1,31 @@
+import numpy as np
+import torch
+from ultralytics.models.yolo.detect import DetectionPredictor
+
+
+# -------------------------------
+# Pinned-memory Preprocessing
+# -------------------------------
+class PinnedDetectionPredictor(DetectionPredictor):
+    # Stages each letterboxed NCHW batch in a reusable page-locked buffer so the
+    # host-to-device copy can run asynchronously instead of from pageable memory
+    _pinned = None
+
+    def preprocess(self, im):
+        if isinstance(im, torch.Tensor) or self.device.type != "cuda":
+            return super().preprocess(im)
+
+        batch = np.stack(self.pre_transform(im))
+        if batch.shape[-1] == 3:
+            batch = batch[..., ::-1]  # BGR to RGB
+        batch = batch.transpose((0, 3, 1, 2))  # BHWC to BCHW
+
+        # Grow the buffer only when a larger batch arrives, otherwise reuse a view of it
+        if self._pinned is None or self._pinned.numel() < batch.size:
+            self._pinned = torch.empty(batch.size, dtype=torch.uint8).pin_memory()
+        staged = self._pinned[:batch.size].view(batch.shape)
+        staged.numpy()[...] = batch
+
+        im = staged.to(self.device, non_blocking=True)
+        im = im.half() if self.model.fp16 else im.float()
+        return im / 255
@@ -1,34 +1,202 @@
 import streamlit as st
+import hashlib
+import math
 import os
-from datetime import datetime, timedelta
-from dotenv import load_dotenv
+from datetime import datetime
 import google.generativeai as genai
 import tempfile
-from PIL import Image
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from utils import load_api_key, configure_gemini, build_prompt, build_pdf
+
+# Must be the first Streamlit command; cached loaders below may render spinners
+st.set_page_config(page_title="Substation Inspection", layout="wide")
 
 # -------------------------------
 # API Key Setup
 # -------------------------------
-api_key = None
-if "GEMINI_API_KEY" in st.secrets:
-    api_key = st.secrets["GEMINI_API_KEY"]
-else:
-    load_dotenv()
-    api_key = os.getenv("GEMINI_API_KEY")
-
+api_key = load_api_key()
 if not api_key:
     st.error("No API key found. Please set GEMINI_API_KEY in secrets or .env file.")
 else:
-    genai.configure(api_key=api_key)
+    configure_gemini(api_key)
 
 # -------------------------------
-# Streamlit App UI
+# Model Setup
 # -------------------------------
-st.set_page_config(page_title="Substation Inspection", layout="wide")
+# On NVIDIA hosts export a TensorRT FP16 engine once with:
+#   yolo export model=best.pt format=engine imgsz=640 half=True dynamic=True batch=8 device=0
+# On CPU-only hosts export an OpenVINO INT8 model instead with:
+#   yolo export model=best.pt format=openvino imgsz=640 int8=True data=data.yaml
+# Whichever export is present is used automatically, otherwise the PyTorch weights.
+ENGINE_PATH = "best.engine"
+OPENVINO_PATH = "best_openvino_model"
+WEIGHTS_PATH = "best.pt"
+if os.path.exists(ENGINE_PATH):
+    MODEL_PATH = ENGINE_PATH
+elif os.path.isdir(OPENVINO_PATH):
+    MODEL_PATH = OPENVINO_PATH
+else:
+    MODEL_PATH = WEIGHTS_PATH
+MAX_BATCH = 8
+# Uploads are downscaled to this size; YOLO letterboxes to 640 anyway
+MAX_IMAGE_SIZE = (1280, 1280)
+# Gemini caps inline requests at 20 MB, measured after base64 encoding the images
+MAX_REQUEST_BYTES = 20_000_000
+# Each cached detection is one annotated frame of up to 1280px (~5 MB)
+MAX_CACHED_DETECTIONS = 64
+MAX_CACHED_REPORTS = 128
+
+
+@st.cache_resource
+def get_yolo():
+    # Imported here so sessions that skip YOLO never load torch/ultralytics
+    from ultralytics import YOLO
+    from predictor import PinnedDetectionPredictor
+    model = YOLO(MODEL_PATH)
+
+    # Warm up once so the predictor is built with pinned-memory preprocessing
+    # and holds the fused network; later predict calls reuse it
+    device = get_device()
+    warmup = [np.zeros((640, 640, 3), dtype=np.uint8)] * MAX_BATCH
+    model.predict(
+        warmup,
+        predictor=PinnedDetectionPredictor,
+        batch=MAX_BATCH,
+        imgsz=640,
+        rect=False,
+        device=device,
+        half=device != "cpu",
+        verbose=False
+    )
+
+    if is_compiled():
+        import torch
+        # Compile the fused network with a dynamic batch dimension. CUDA-graph modes
+        # ("reduce-overhead") are avoided because their captured graphs live in
+        # thread-local state and Streamlit runs each rerun on a new thread.
+        backend = model.predictor.model
+        backend.model = torch.compile(backend.model, dynamic=True)
+
+        # Run a full and a single-image batch (size 1 is specialised separately)
+        # so compilation happens before the first user request
+        for frames in (warmup, warmup[:1]):
+            model.predict(
+                frames,
+                batch=len(frames),
+                imgsz=640,
+                rect=False,
+                device=device,
+                half=True,
+                verbose=False
+            )
+    return model
+
+
+def is_compiled():
+    # torch.compile is only applied to the PyTorch weights on GPU hosts
+    return MODEL_PATH == WEIGHTS_PATH and get_device() != "cpu"
+
+
+@st.cache_resource
+def get_device():
+    # Run on the first GPU in FP16 when available, otherwise FP32 on CPU
+    import torch
+    return 0 if torch.cuda.is_available() else "cpu"
+
+
+@st.cache_resource
+def get_gemini():
+    return genai.GenerativeModel("gemini-1.5-flash")
+
+
+@st.cache_resource
+def get_upload_executor():
+    return ThreadPoolExecutor(max_workers=16)
+
+
+@st.cache_resource
+def get_report_cache():
+    # Shared across sessions and filled after a report finishes streaming, which
+    # st.cache_data cannot do without giving up progressive rendering. Sessions run
+    # on separate threads, so every access goes through the lock.
+    return {}, threading.Lock()
+
+
+def report_key(prompt, image_blobs):
+    # The prompt embeds today's date, so cached reports expire daily
+    digest = hashlib.sha256(prompt.encode())
+    for blob in image_blobs:
+        digest.update(blob)
+    return digest.hexdigest()
+
+
+def encode_jpeg(img_bgr):
+    _, jpeg = cv2.imencode(".jpg", img_bgr, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return jpeg.tobytes()
+
 
+def load_image(data):
+    # OpenCV's SIMD libjpeg-turbo decode is markedly faster than PIL on large photos
+    # Images stay BGR, which is what YOLO, cv2.imencode and st.image(channels="BGR") take
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    height, width = img.shape[:2]
+    scale = min(MAX_IMAGE_SIZE[0] / width, MAX_IMAGE_SIZE[1] / height)
+    if scale < 1:
+        size = (round(width * scale), round(height * scale))
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    return img
+
+
+@st.cache_resource
+def get_detection_cache():
+    # Annotated frames keyed on a hash of each upload's bytes, shared across sessions.
+    # A plain dict rather than st.cache_data so that a run can look up every image
+    # first and batch only the misses into one predict call.
+    return {}, threading.Lock()
+
+
+def detect(image_bytes, images):
+    detection_cache, detection_cache_lock = get_detection_cache()
+    keys = [hashlib.sha256(data).hexdigest() for data in image_bytes]
+    with detection_cache_lock:
+        detected_images = [detection_cache.get(key) for key in keys]
+
+    misses = [i for i, detected in enumerate(detected_images) if detected is None]
+    if not misses:
+        return detected_images
+
+    # rect=False letterboxes every frame to a fixed 640x640 instead of the
+    # smallest stride-aligned shape, so the compiled network only sees the batch vary
+    device = get_device()
+    results = get_yolo().predict(
+        [images[i] for i in misses],
+        conf=0.3,
+        batch=min(len(misses), MAX_BATCH),
+        imgsz=640,
+        rect=False,
+        device=device,
+        half=device != "cpu",
+        verbose=False
+    )
+
+    for i, result in zip(misses, results):
+        detected_images[i] = result.plot()
+
+    with detection_cache_lock:
+        for i in misses:
+            if len(detection_cache) >= MAX_CACHED_DETECTIONS:
+                detection_cache.pop(next(iter(detection_cache)))
+            detection_cache[keys[i]] = detected_images[i]
+    return detected_images
+
+# -------------------------------
+# Streamlit App UI
+# -------------------------------
 st.title("⚡ Substation Inspection Report Generator")
 
 with st.sidebar:
@@ -40,6 +208,7 @@ with st.sidebar:
         value=7,
         step=1
     )
+    use_yolo = st.checkbox("Run YOLO pre-detection", value=True)
 
 uploaded_files = st.file_uploader(
     "📂 Upload Substation Images",
@@ -48,95 +217,103 @@ uploaded_files = st.file_uploader(
 )
 
 if uploaded_files:
+    # Decode each upload once and keep the pixels in memory; OpenCV releases the GIL
+    # while decoding, so a thread pool spreads the work across cores
+    image_bytes = [file.getvalue() for file in uploaded_files]
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        decoded = list(pool.map(load_image, image_bytes))
+
+    # cv2.imdecode returns None for files it cannot read
+    for file, img in zip(uploaded_files, decoded):
+        if img is None:
+            st.error(f"Could not read {file.name}, skipping it.")
+    image_bytes = [data for data, img in zip(image_bytes, decoded) if img is not None]
+    images = [img for img in decoded if img is not None]
+    if not images:
+        st.stop()
+
     st.subheader("📸 Uploaded Images")
     cols = st.columns(3)
-    for i, uploaded_file in enumerate(uploaded_files):
-        img = Image.open(uploaded_file)
+    for i, img in enumerate(images):
         with cols[i % 3]:
-            st.image(img, caption=f"Image {i+1}", use_container_width=True)
-
-    # Save images temporarily
-    temp_files = []
-    for file in uploaded_files:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-            tmp.write(file.getvalue())
-            temp_files.append(tmp.name)
+            st.image(img, caption=f"Image {i+1}", channels="BGR", use_container_width=True)
 
     if st.button("🔍 Generate Report"):
-        with st.spinner("Analyzing images..."):
-            # Prepare prompt
-            prompt = f"""
-            You are an inspection assistant. 
-            Analyze the uploaded images of a substation. 
-            Detect the components (Insulators, Towers) and classify each as Damaged or Intact.
-            Then generate a structured inspection report in clean Markdown.
-
-            Today's date: {datetime.now().strftime("%Y-%m-%d")}
-            Next inspection date: {(datetime.now() + timedelta(days=inspection_days)).strftime("%Y-%m-%d")}
-
-            Format the report like this:
-
-            ## Substation Inspection Summary
-
-            **Date of Inspection:** YYYY-MM-DD  
-            **Substation Name/ID:** Auto-generated if not available  
+        if use_yolo:
+            with st.spinner("Detecting components..."):
+                # Only images not detected before go through YOLO; the annotated
+                # images are what gets sent to Gemini
+                try:
+                    detected_images = detect(image_bytes, images)
+                except Exception as e:
+                    st.error(f"Error: {e}")
+                    st.stop()
 
-            **Components Inspected:** Insulators, Towers  
+            st.subheader("🎯 Detected Components")
+            cols = st.columns(3)
+            for i, detected in enumerate(detected_images):
+                with cols[i % 3]:
+                    st.image(detected, caption=f"Detected {i+1}", channels="BGR", use_container_width=True)
 
-            **Inspection Results:**
+            report_images = detected_images
+        else:
+            report_images = images
 
-            | Component   | Quantity Detected | Intact | Damaged |
-            |-------------|------------------:|-------:|--------:|
-            | Towers      | X                 | Y      | Z       |
-            | Insulators  | X                 | Y      | Z       |
-
-            **Summary of Findings:**  
-            (Write findings clearly here.)
+        with st.spinner("Analyzing images..."):
+            # Encode each image once as JPEG, which keeps photos far smaller than PNG
+            image_blobs = [encode_jpeg(img) for img in report_images]
+            prompt = build_prompt(inspection_days)
+            gemini_model = get_gemini()
 
-            **Maintenance Recommendations:**  
-            (Give actionable advice.)
+            try:
+                report_cache, report_cache_lock = get_report_cache()
+                key = report_key(prompt, image_blobs)
+                with report_cache_lock:
+                    report = report_cache.get(key)
+                if report is not None:
+                    # Same prompt and images as an earlier run, reuse that report
+                    st.markdown(report)
+                else:
+                    # Base64 turns every 3 bytes into 4
+                    total_bytes = sum(len(blob) for blob in image_blobs)
+                    request_bytes = 4 * math.ceil(total_bytes / 3) + len(prompt.encode())
+                    if request_bytes <= MAX_REQUEST_BYTES:
+                        # Send the images inline with the prompt in a single request
+                        image_parts = [{"mime_type": "image/jpeg", "data": blob} for blob in image_blobs]
+                    else:
+                        # Too large for one request, fall back to concurrent Files API uploads.
+                        # The files are only needed until the uploads finish.
+                        with tempfile.TemporaryDirectory(prefix="substation_") as tmpdir:
+                            image_paths = []
+                            for i, blob in enumerate(image_blobs):
+                                image_path = os.path.join(tmpdir, f"image_{i}.jpg")
+                                with open(image_path, "wb") as f:
+                                    f.write(blob)
+                                image_paths.append(image_path)
+                            image_parts = list(get_upload_executor().map(genai.upload_file, image_paths))
 
-            **Next Inspection Date:** YYYY-MM-DD
-            """
+                    # Stream the report and render it as the chunks arrive
+                    placeholder = st.empty()
+                    chunks = []
+                    for chunk in gemini_model.generate_content([prompt] + image_parts, stream=True):
+                        chunks.append(chunk.text)
+                        placeholder.markdown("".join(chunks))
+                    report = "".join(chunks)
 
-            model = genai.GenerativeModel("gemini-1.5-flash")
-
-            try:
-                response = model.generate_content(
-                    [prompt] + [genai.upload_file(file) for file in temp_files]
-                )
-                report = response.text
+                    with report_cache_lock:
+                        if len(report_cache) >= MAX_CACHED_REPORTS:
+                            report_cache.pop(next(iter(report_cache)))
+                        report_cache[key] = report
 
                 st.success("✅ Report generated successfully!")
-                st.markdown(report)
-
-                # -------------------------------
-                # Convert Report to PDF
-                # -------------------------------
-                pdf_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-                c = canvas.Canvas(pdf_file.name, pagesize=A4)
-                width, height = A4
-
-                # Add title
-                c.setFont("Helvetica-Bold", 14)
-                c.drawString(1 * inch, height - 1 * inch, "Substation Inspection Report")
-
-                # Add report text
-                c.setFont("Helvetica", 10)
-                text_obj = c.beginText(1 * inch, height - 1.5 * inch)
-                for line in report.split("\n"):
-                    text_obj.textLine(line)
-                c.drawText(text_obj)
-                c.save()
 
                 # Download button for PDF
-                with open(pdf_file.name, "rb") as f:
-                    st.download_button(
-                        label="📥 Download Report (PDF)",
-                        data=f,
-                        file_name=f"inspection_report_{datetime.now().strftime('%Y%m%d')}.pdf",
-                        mime="application/pdf"
-                    )
+                st.download_button(
+                    label="📥 Download Report (PDF)",
+                    data=build_pdf(report),
+                    file_name=f"inspection_report_{datetime.now().strftime('%Y%m%d')}.pdf",
+                    mime="application/pdf"
+                )
 
             except Exception as e:
                 st.error(f"Error: {e}")
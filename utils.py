@@ -0,0 +1,97 @@
+import streamlit as st
+import io
+import os
+import re
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import google.generativeai as genai
+from xml.sax.saxutils import escape
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+
+
+# -------------------------------
+# API Key Setup
+# -------------------------------
+def load_api_key():
+    # Looked up on every run so a key added to secrets or .env is picked up without a restart
+    if "GEMINI_API_KEY" in st.secrets:
+        return st.secrets["GEMINI_API_KEY"]
+    load_dotenv()
+    return os.getenv("GEMINI_API_KEY")
+
+
+@st.cache_resource(show_spinner=False)
+def configure_gemini(api_key):
+    genai.configure(api_key=api_key)
+
+
+# -------------------------------
+# Prompt
+# -------------------------------
+def build_prompt(inspection_days):
+    return f"""
+    You are an inspection assistant. 
+    Analyze the uploaded images of a substation. 
+    Detect the components (Insulators, Towers) and classify each as Damaged or Intact.
+    Then generate a structured inspection report in clean Markdown.
+
+    Today's date: {datetime.now().strftime("%Y-%m-%d")}
+    Next inspection date: {(datetime.now() + timedelta(days=inspection_days)).strftime("%Y-%m-%d")}
+
+    Format the report like this:
+
+    ## Substation Inspection Summary
+
+    **Date of Inspection:** YYYY-MM-DD  
+    **Substation Name/ID:** Auto-generated if not available  
+
+    **Components Inspected:** Insulators, Towers  
+
+    **Inspection Results:**
+
+    | Component   | Quantity Detected | Intact | Damaged |
+    |-------------|------------------:|-------:|--------:|
+    | Towers      | X                 | Y      | Z       |
+    | Insulators  | X                 | Y      | Z       |
+
+    **Summary of Findings:**  
+    (Write findings clearly here.)
+
+    **Maintenance Recommendations:**  
+    (Give actionable advice.)
+
+    **Next Inspection Date:** YYYY-MM-DD
+    """
+
+
+# -------------------------------
+# Convert Report to PDF
+# -------------------------------
+def build_pdf(report):
+    # Build the PDF in memory; platypus wraps long lines and paginates
+    pdf_buffer = io.BytesIO()
+    doc = SimpleDocTemplate(
+        pdf_buffer,
+        pagesize=A4,
+        leftMargin=1 * inch,
+        rightMargin=1 * inch,
+        topMargin=1 * inch,
+        bottomMargin=1 * inch,
+        title="Substation Inspection Report"
+    )
+    styles = getSampleStyleSheet()
+
+    # Add title
+    flow = [Paragraph("Substation Inspection Report", styles["Heading2"])]
+
+    # Add report text, one paragraph per blank-line separated block with the
+    # block's lines kept as line breaks (Paragraph takes markup, so escape it)
+    for block in re.split(r"\n\s*\n", report.strip()):
+        flow.append(Paragraph(escape(block).replace("\n", "<br/>"), styles["Normal"]))
+        flow.append(Spacer(1, styles["Normal"].leading))
+    doc.build(flow)
+
+    return pdf_buffer.getvalue()